@@ -1,12 +1,32 @@
 import argparse
+import functools
+import hashlib
 import math
+import mmap
 import os
-from collections import Counter
+import struct
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Tuple, Optional
 
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
 import mido
+import numpy as np
+
+HEADLESS = os.environ.get("MIDIPLOT_HEADLESS", "").strip().lower() in ("1", "true", "yes")
+
+if HEADLESS:
+    # Agg skips GUI toolkit setup, which dominates figure creation in batch runs
+    matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the byte scanner then runs as plain Python
+    njit = None
 
 NOTE_NAMES_PC = [
     "C",
@@ -51,59 +71,298 @@ ALIAS_TO_PART = {
     "sopran 2": "Soprano 2",
 }
 
+# Lowercased lookup tables, sorted by length descending so that e.g. "Bass 2" is
+# checked before "Bass" and "sopran 2" before "sopran".
+_VOICE_RANGES_LOWER = tuple(
+    (part.lower(), zones)
+    for part, zones in sorted(
+        VOICE_RANGES.items(), key=lambda item: len(item[0]), reverse=True
+    )
+)
+_ALIASES_LOWER = tuple(
+    (alias.lower(), VOICE_RANGES[part])
+    for alias, part in sorted(
+        ALIAS_TO_PART.items(), key=lambda item: len(item[0]), reverse=True
+    )
+)
+
+
+def _cache_home() -> Path:
+    # Per the XDG spec, an unset, empty or relative XDG_CACHE_HOME is ignored
+    xdg_cache_home = Path(os.environ.get("XDG_CACHE_HOME") or "")
+    if not xdg_cache_home.is_absolute():
+        return Path.home() / ".cache"
+    return xdg_cache_home
+
 
-def note_number_to_name(n: int) -> str:
-    octave = n // 12 - 1
-    pc = NOTE_NAMES_PC[n % 12]
-    return f"{pc}{octave}"
+# Folder mode caches each file's note counts here, keyed by path, mtime and size.
+# Bump the version whenever the way counts are computed changes.
+CACHE_DIR = _cache_home() / "midiplot"
+_CACHE_VERSION = 2
 
+# Names for all 128 MIDI note numbers, e.g. 60 -> "C4"
+NOTE_NAME_TABLE = tuple(f"{NOTE_NAMES_PC[n % 12]}{n // 12 - 1}" for n in range(128))
 
-def extract_notes_from_track(track) -> List[int]:
-    """Return a list of MIDI note numbers (0-127) for note_on events in a single track."""
-    return [msg.note for msg in track if msg.type == "note_on" and msg.velocity > 0]
+note_number_to_name = NOTE_NAME_TABLE.__getitem__
 
 
+def extract_note_counts(track) -> np.ndarray:
+    """Return a 128-bin array of note_on counts per MIDI note number in a single track."""
+    # Incrementing a list is much cheaper than indexing into a numpy array per message
+    counts = [0] * 128
+    for msg in track:
+        if msg.type == "note_on" and msg.velocity > 0:
+            counts[msg.note] += 1
+    return np.array(counts, dtype=np.int64)
 
+
+@functools.lru_cache(maxsize=None)
 def get_voice_zones(name_identifier: str) -> Optional[dict]:
     """Find voice ranges based on a string (track name or filename)."""
     lower_name = name_identifier.lower()
 
     # 1. Check Canonical Names
-    # Sort keys by length descending so "Bass 2" (len 6) is checked before "Bass" (len 4)
-    # and "Soprano 1" is checked before "Soprano".
-    sorted_parts = sorted(VOICE_RANGES.keys(), key=len, reverse=True)
-    for part in sorted_parts:
-        if part.lower() in lower_name:
-            return VOICE_RANGES[part]
+    for part, zones in _VOICE_RANGES_LOWER:
+        if part in lower_name:
+            return zones
 
     # 2. Check Aliases
-    # Same logic: "sopran 2" must be checked before "sopran"
-    sorted_aliases = sorted(ALIAS_TO_PART.keys(), key=len, reverse=True)
-    for alias in sorted_aliases:
+    for alias, zones in _ALIASES_LOWER:
         if alias in lower_name:
-            canonical = ALIAS_TO_PART[alias]
-            return VOICE_RANGES[canonical]
+            return zones
 
     return None
 
 
-def collect_data_from_single_file(filepath: Path) -> List[Tuple[str, List[int]]]:
+def _optional_njit(func):
+    """JIT-compile func with numba when it is installed, otherwise return it unchanged."""
+    return njit(cache=True, nogil=True)(func) if njit is not None else func
+
+
+@_optional_njit
+def _meta_payload_ok(buf, start, meta_type, length):
+    """Return False for meta event data that mido would fail to decode."""
+    if meta_type == 0x00:  # sequence_number: empty or at least two bytes
+        return length != 1
+    if meta_type == 0x20:  # channel_prefix
+        return length >= 1
+    if meta_type == 0x51:  # set_tempo
+        return length >= 3
+    if meta_type == 0x54:  # smpte_offset, with one of the four known frame rates
+        return length >= 5 and buf[start] >> 5 < 4
+    if meta_type == 0x58:  # time_signature
+        return length >= 4
+    if meta_type == 0x59:  # key_signature: -7..7 sharps/flats, major or minor
+        if length < 2:
+            return False
+        key = int(buf[start])
+        return (key <= 7 or key >= 256 - 7) and buf[start + 1] <= 1
+    return True
+
+
+@_optional_njit
+def _scan_track_bytes(buf):
+    """
+    Count note_on events (velocity > 0) in the raw bytes of one MTrk chunk.
+    Returns (counts, name_start, name_end), where the slice locates the data of the
+    first track_name meta event, or is (-1, -1) if there is none.
+    Mirrors mido's reader: meta events don't set running status, sysex events do,
+    and an end_of_track event doesn't stop the scan before the end of the chunk.
+    Raises ValueError for anything mido would reject, so that those files can be
+    handed to mido for its error message.
+    """
+    counts = np.zeros(128, dtype=np.int64)
+    name_start = -1
+    name_end = -1
+    size = len(buf)
+    running_status = 0
+    i = 0
+    while i < size:
+        # Skip the variable-length delta time
+        while i < size and buf[i] & 0x80:
+            i += 1
+        i += 1
+        if i >= size:
+            raise ValueError("truncated event")
+
+        status = buf[i]
+        is_running = False
+        if status & 0x80:
+            i += 1
+            if status != 0xFF:
+                running_status = status
+        elif running_status:
+            # Running status: the byte just read is already the first data byte
+            status = running_status
+            is_running = True
+        else:
+            raise ValueError("running status without last status")
+
+        if status == 0xFF or status == 0xF0 or status == 0xF7:
+            meta_type = -1
+            if status == 0xFF:
+                if i >= size:
+                    raise ValueError("truncated meta event")
+                meta_type = buf[i]
+                i += 1
+            elif is_running:
+                # Like mido, sysex under running status drops the byte already read
+                i += 1
+            # Meta and sysex events carry a variable-length data length
+            length = 0
+            while True:
+                if i >= size:
+                    raise ValueError("truncated event length")
+                byte = buf[i]
+                i += 1
+                length = (length << 7) | (byte & 0x7F)
+                if byte < 0x80:
+                    break
+            if i + length > size:
+                raise ValueError("event data runs past the end of the track")
+            if meta_type >= 0 and not _meta_payload_ok(buf, i, meta_type, length):
+                raise ValueError("malformed meta event")
+            if meta_type == 0x03 and name_start < 0:
+                name_start = i
+                name_end = i + length
+            i += length
+        elif status < 0xF0:
+            kind = status & 0xF0
+            if kind == 0xC0 or kind == 0xD0:
+                i += 1
+            else:
+                if kind == 0x90 and i + 1 < size and buf[i + 1] > 0:
+                    # Clip out-of-range data bytes like mido's clip=True
+                    counts[min(buf[i], 127)] += 1
+                i += 2
+        elif status == 0xF2:
+            i += 2
+        elif status == 0xF1 or status == 0xF3:
+            i += 1
+        elif status == 0xF4 or status == 0xF5 or status == 0xF9 or status == 0xFD:
+            raise ValueError("undefined status byte")
+        elif is_running:
+            # Messages without data bytes can't take the byte already read
+            raise ValueError("running status for a message without data")
+
+    if i > size:
+        raise ValueError("event runs past the end of the track")
+
+    return counts, name_start, name_end
+
+
+def _scan_track_chunk(chunk: bytes) -> Tuple[str, np.ndarray]:
+    """Return (track name, note counts) for the data of one MTrk chunk."""
+    # The compiled kernel needs an array; plain Python indexes bytes faster
+    buf = np.frombuffer(chunk, dtype=np.uint8) if njit is not None else chunk
+    counts, name_start, name_end = _scan_track_bytes(buf)
+    name = chunk[name_start:name_end].decode("latin1") if name_start >= 0 else ""
+    return name, counts
+
+
+def _scan_midi_file(filepath: Path) -> List[Tuple[str, np.ndarray]]:
+    """
+    Return (track name, note counts) for every track by scanning the raw file bytes,
+    without constructing mido messages. Raises ValueError on malformed files.
+    """
+    # mmap raises ValueError for empty files, which sends them to the mido fallback
+    with open(filepath, "rb") as fh, mmap.mmap(
+        fh.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        size = len(mm)
+        if size < 14 or mm[:4] != b"MThd":
+            raise ValueError("MThd not found")
+
+        header_size, _, num_tracks = struct.unpack_from(">IHH", mm, 4)
+        pos = 8 + header_size
+        tracks = []
+
+        for _ in range(num_tracks):
+            if pos + 8 > size:
+                raise ValueError("missing MTrk chunk")
+            chunk_type, chunk_size = struct.unpack_from(">4sI", mm, pos)
+            chunk_end = pos + 8 + chunk_size
+            if chunk_type != b"MTrk" or chunk_end > size:
+                raise ValueError("missing or truncated MTrk chunk")
+
+            # Scan a copy of the chunk, so no view of the map can outlive close()
+            # (e.g. held by a traceback), which would fail with a BufferError
+            tracks.append(_scan_track_chunk(mm[pos + 8 : chunk_end]))
+            pos = chunk_end
+
+    return tracks
+
+
+def read_track_note_counts(filepath: Path) -> List[Tuple[str, np.ndarray]]:
+    """
+    Return (track name, note counts) for every track in a MIDI file.
+    Files the byte scanner can't handle are parsed with mido instead, so that
+    genuinely broken files are reported with mido's error messages.
+    """
+    try:
+        return _scan_midi_file(filepath)
+    except ValueError:
+        midi = mido.MidiFile(filepath, clip=True)
+        return [(track.name, extract_note_counts(track)) for track in midi.tracks]
+
+
+def collect_data_from_single_file(filepath: Path) -> List[Tuple[str, np.ndarray]]:
     """
     Standard mode: Open one MIDI file and treat every internal track as a separate entity.
     """
-    midi = mido.MidiFile(filepath)
     tracks_with_notes = []
 
-    for idx, track in enumerate(midi.tracks):
-        notes = extract_notes_from_track(track)
-        if notes:
-            name = track.name.strip() or f"Track {idx}"
-            tracks_with_notes.append((name, notes))
+    for idx, (track_name, counts) in enumerate(read_track_note_counts(filepath)):
+        if counts.any():
+            name = track_name.strip() or f"Track {idx}"
+            tracks_with_notes.append((name, counts))
 
     return tracks_with_notes
 
 
-def collect_data_from_directory(dirpath: Path) -> List[Tuple[str, List[int]]]:
+def _cache_path(filepath: Path) -> Path:
+    stat = filepath.stat()
+    key = f"{_CACHE_VERSION}:{filepath.resolve()}:{stat.st_mtime_ns}:{stat.st_size}"
+    digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    return CACHE_DIR / f"{digest}.npy"
+
+
+def _read_file_note_counts(filepath: Path) -> np.ndarray:
+    """
+    Return note counts for a MIDI file with all of its tracks merged.
+    Results are cached on disk, so unchanged files are not parsed again.
+    """
+    cache_path = _cache_path(filepath)
+    # Missing, truncated (e.g. after a crash) or otherwise bad entries are re-parsed
+    try:
+        cached_counts = np.load(cache_path)
+        if cached_counts.shape == (128,):
+            return cached_counts
+    except (OSError, ValueError, EOFError):
+        pass
+
+    all_file_counts = np.zeros(128, dtype=np.int64)
+    for _, counts in read_track_note_counts(filepath):
+        all_file_counts += counts
+
+    # Write to a temporary file first so other processes never see a partial entry.
+    # Failing to cache (e.g. a read-only home directory) is not an error.
+    tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, "wb") as fh:
+            np.save(fh, all_file_counts)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+
+    return all_file_counts
+
+
+def collect_data_from_directory(dirpath: Path) -> List[Tuple[str, np.ndarray]]:
     """
     Folder mode: Find all MIDI files. Treat each FILE as a separate entity
     (merging all internal tracks of that file).
@@ -115,37 +374,78 @@ def collect_data_from_directory(dirpath: Path) -> List[Tuple[str, List[int]]]:
         print(f"No .mid or .midi files found in {dirpath}")
         return []
 
-    for f in files:
-        try:
-            midi = mido.MidiFile(f)
-            # Merge all tracks in this file into one list of notes
-            all_file_notes = []
-            for track in midi.tracks:
-                all_file_notes.extend(extract_notes_from_track(track))
-
-            if all_file_notes:
-                # Use last part of filename stem as the name
-                tracks_with_notes.append((f.stem.split("-")[-1], all_file_notes))
-        except Exception as e:
-            print(f"Error reading {f}: {e}")
+    # Files are independent, so read them concurrently. Threads overlap file and cache
+    # I/O (and the numba kernel, which releases the GIL). The byte scanner is fast
+    # enough that a process pool's start-up cost would outweigh any gain.
+    with ThreadPoolExecutor() as executor:
+        futures = [executor.submit(_read_file_note_counts, f) for f in files]
+        for f, future in zip(files, futures):
+            try:
+                all_file_counts = future.result()
+                if all_file_counts.any():
+                    # Use last part of filename stem as the name
+                    tracks_with_notes.append((f.stem.split("-")[-1], all_file_counts))
+            except Exception as e:
+                print(f"Error reading {f}: {e}")
 
     return tracks_with_notes
 
 
-def generate_plots(data_list: List[Tuple[str, List[int]]], source_title: str) -> None:
+def _ensure_figure(
+    rows: int, cols: int, fig: Optional[Figure] = None
+) -> Tuple[Figure, np.ndarray]:
+    """
+    Return a figure and its flattened rows x cols grid of axes.
+    A given figure is reused, with its axes cleared, if it already holds such a grid;
+    otherwise a new figure is created.
+    """
+    if fig is not None:
+        ax_list = fig.axes
+        if len(ax_list) == rows * cols and all(
+            ax.get_subplotspec() is not None
+            and ax.get_subplotspec().get_geometry()[:2] == (rows, cols)
+            for ax in ax_list
+        ):
+            for ax in ax_list:
+                ax.clear()
+            return fig, np.array(ax_list)
+
+    # Adjust figure size dynamically based on rows
+    # Constrained layout places subplots as they are drawn, avoiding a tight_layout pass
+    fig, axes = plt.subplots(
+        rows,
+        cols,
+        sharex=True,
+        figsize=(cols * 6, rows * 4),
+        squeeze=False,
+        constrained_layout=True,
+    )
+    return fig, axes.flatten()
+
+
+def generate_plots(
+    data_list: List[Tuple[str, np.ndarray]],
+    source_title: str,
+    save_path: Optional[Path] = None,
+    fig: Optional[Figure] = None,
+) -> Optional[Figure]:
     """
     Generic plotting function.
-    data_list: List of tuples (Name, [NoteInts])
+    data_list: List of tuples (Name, 128-bin array of note counts)
     source_title: String title for the entire figure
+    save_path: If given, write the figure to this file instead of showing it
+    fig: Figure returned by an earlier call. Its subplots are reused if the grid
+        shape still fits, which saves recreating them when re-plotting interactively.
+    Returns the figure that was drawn on, or None if there was nothing to plot.
     """
     if not data_list:
         print("No notes found to plot.")
-        return
+        return None
 
     # Print summary to console
     total_notes = 0
-    for name, notes in data_list:
-        count = len(notes)
+    for name, counts in data_list:
+        count = int(counts.sum())
         print(f"{name}: {count}")
         total_notes += count
     print(f"Total: {total_notes}")
@@ -154,82 +454,103 @@ def generate_plots(data_list: List[Tuple[str, List[int]]], source_title: str) ->
     cols = 2
     rows = math.ceil(n / cols)
 
-    # Adjust figure size dynamically based on rows
-    fig, axes = plt.subplots(rows, cols, figsize=(cols * 6, rows * 4), squeeze=False)
-    ax_list = axes.flatten()
-
-    # Hide unused subplots
-    for ax in ax_list[n:]:
-        ax.set_visible(False)
-
-    for ax, (name, notes) in zip(ax_list, data_list):
-        counts = Counter(notes)
-        if not counts:
-            continue
-
-        xs, ys = zip(*sorted(counts.items()))
-
-        zones = get_voice_zones(name)
+    # Determine X-Axis Limits, shared by all subplots
+    # The view covers every track's notes plus any defined lower/upper ranges
+    zones_list = [get_voice_zones(name) for name, _ in data_list]
+    used_notes = np.nonzero(np.sum([counts for _, counts in data_list], axis=0))[0]
+    if not used_notes.size:
+        print("No notes found to plot.")
+        return None
 
-        # Determine X-Axis Limits
+    # nonzero() returns sorted indices, so the extremes are just the ends
+    min_note, max_note = int(used_notes[0]), int(used_notes[-1])
+    for zones in zones_list:
         if zones:
-            # Ensure the view covers at least the defined lower/upper range OR the actual notes
-            min_note = min(min(xs), zones["lower"][0])
-            max_note = max(max(xs), zones["upper"][1])
-        else:
-            min_note, max_note = min(xs), max(xs)
-
-        ax.set_xlim(min_note - 2, max_note + 2)
-
-        xtick_positions = [p for p in range(min_note, max_note + 1) if p % 12 == 0]
-        if not xtick_positions:
-            xtick_positions = [min_note, max_note]
-
-        ax.bar(xs, ys, width=0.8, align="edge")
-        ax.set_xticks(xtick_positions)
+            min_note = min(min_note, zones["lower"][0])
+            max_note = max(max_note, zones["upper"][1])
+
+    # One tick per C, starting from the first multiple of 12 in range
+    first_c = (min_note + 11) // 12 * 12
+    xtick_positions = np.arange(first_c, max_note + 1, 12)
+    if not xtick_positions.size:
+        xtick_positions = np.array([min_note, max_note])
+
+    fig, ax_list = _ensure_figure(rows, cols, fig)
+
+    # Hide unused subplots. Only the lowest visible subplot in each column shows
+    # tick labels, which may be one row up when the last row isn't full.
+    first_labelled = max(n - cols, 0)
+    for idx, ax in enumerate(ax_list):
+        ax.set_visible(idx < n)
+        ax.xaxis.set_tick_params(labelbottom=first_labelled <= idx < n)
+
+    # Limits and ticks are shared, so set them once
+    ax_list[0].set_xlim(min_note - 2, max_note + 2)
+    ax_list[0].set_xticks(xtick_positions)
+
+    # The lowest visible subplot in each column carries the pitch labels
+    for ax in ax_list[first_labelled:n]:
         ax.set_xticklabels(
             [note_number_to_name(p) for p in xtick_positions],
             rotation=45,
             ha="right",
             fontsize=8,
         )
+        ax.set_xlabel("Pitch")
+
+    # Bars become a bitmap in vector output (PDF/SVG) and in large grids, which keeps
+    # file size and render time down; axes, text and zones stay as vectors
+    rasterize_bars = save_path is not None or n > 8
+
+    for ax, (name, counts), zones in zip(ax_list, data_list, zones_list):
+        xs = np.nonzero(counts)[0]
+        if not xs.size:
+            continue
+
+        ys = counts[xs]
+
+        # Float arrays go straight into the bar geometry without per-bar conversion
+        ax.bar(
+            xs.astype(np.float64),
+            ys.astype(np.float64),
+            width=0.8,
+            align="edge",
+            rasterized=rasterize_bars,
+        )
 
         # Draw Range Zones
         if zones:
-            # Lower (Warning/Extension)
-            ax.axvspan(
-                zones["lower"][0],
-                zones["lower"][1] + 1,
-                color="orange",
-                alpha=0.2,
-                zorder=0,
-            )
-            # Green (Comfortable)
-            ax.axvspan(
-                zones["green"][0],
-                zones["green"][1] + 1,
-                color="green",
-                alpha=0.2,
-                zorder=0,
-            )
-            # Upper (Warning/Extension)
-            ax.axvspan(
-                zones["upper"][0],
-                zones["upper"][1] + 1,
-                color="orange",
+            # One collection for all three spans instead of a patch per axvspan.
+            # Like axvspan, x is in data coordinates and y spans the whole axes.
+            spans = [
+                zones["lower"],  # Warning/Extension
+                zones["green"],  # Comfortable
+                zones["upper"],  # Warning/Extension
+            ]
+            zone_collection = PolyCollection(
+                [
+                    [(start, 0), (start, 1), (end + 1, 1), (end + 1, 0)]
+                    for start, end in spans
+                ],
+                color=["orange", "green", "orange"],
                 alpha=0.2,
                 zorder=0,
+                transform=ax.get_xaxis_transform(),
             )
+            ax.add_collection(zone_collection, autolim=False)
 
-        ax.set_xlabel("Pitch")
         ax.set_ylabel("Occurrences")
         ax.set_title(name)
 
-    fig.suptitle(
-        f"Note Occurrence Histograms for '{source_title}'", fontsize=14, y=0.98
-    )
-    plt.tight_layout()
-    plt.show()
+    fig.suptitle(f"Note Occurrence Histograms for '{source_title}'", fontsize=14)
+    if save_path:
+        # Resolution used for the rasterized bars
+        fig.savefig(save_path, dpi=150)
+        print(f"Saved plot to {save_path}")
+    else:
+        plt.show()
+
+    return fig
 
 
 def main():
@@ -239,8 +560,18 @@ def main():
     parser.add_argument(
         "input_path", help="Path to a .mid file OR a folder containing .mid files"
     )
+    parser.add_argument(
+        "--save",
+        metavar="PATH",
+        type=Path,
+        help="Save the plot to this file (e.g. plot.png) instead of showing it",
+    )
     args = parser.parse_args()
 
+    if HEADLESS and not args.save:
+        print("Error: MIDIPLOT_HEADLESS is set, so use --save PATH to write the plot to a file.")
+        return
+
     input_path = Path(args.input_path)
 
     if not input_path.exists():
@@ -262,7 +593,11 @@ def main():
         print("Invalid input.")
         return
 
-    generate_plots(data, title)
+    if args.save:
+        # No window will be opened, so avoid initialising a GUI backend
+        plt.switch_backend("Agg")
+
+    generate_plots(data, title, save_path=args.save)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+"""
+Differential tests for the raw MIDI byte scanner: for every file, it must either agree
+with mido (track names and note_on counts) or raise ValueError where mido fails, so
+that read_track_note_counts hands the file to mido for its error message.
+"""
+
+import random
+import struct
+
+import mido
+import numpy as np
+import pytest
+
+import plot
+
+
+def vlq(n):
+    out = [n & 0x7F]
+    n >>= 7
+    while n:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    return bytes(reversed(out))
+
+
+def smf(*tracks):
+    header = b"MThd" + struct.pack(">Ihhh", 6, 1, len(tracks), 480)
+    return header + b"".join(
+        b"MTrk" + struct.pack(">I", len(track)) + track for track in tracks
+    )
+
+
+NOTE = vlq(0) + b"\x90\x3c\x40"
+END_OF_TRACK = vlq(0) + b"\xff\x2f\x00"
+
+META_PAYLOADS = [
+    (0x00, b""),
+    (0x00, b"\x00\x01"),
+    (0x00, b"\x01"),  # mido can't decode a one-byte sequence number
+    (0x01, b"some text"),
+    (0x20, b"\x02"),
+    (0x20, b""),
+    (0x21, b""),
+    (0x51, b"\x07\xa1\x20"),
+    (0x51, b"\x07"),
+    (0x54, b"\x60\x00\x00\x00\x00"),
+    (0x54, b"\x80\x00\x00\x00\x00"),  # undefined frame rate
+    (0x58, b"\x04\x02\x18\x08"),
+    (0x58, b"\x04\x02"),
+    (0x59, b"\xf9\x01"),
+    (0x59, b"\x07\x00"),
+    (0x59, b"\x08\x00"),  # 8 sharps
+    (0x59, b"\x00\x02"),  # unknown mode
+    (0x59, b"\x00"),
+    (0x7F, b"\x00\x01\x02"),
+]
+
+
+def random_track(rng):
+    data = bytearray()
+    last_status = None
+    if rng.random() < 0.7:
+        name = bytes(rng.choice(b"abc\xe9 ") for _ in range(rng.randint(0, 6)))
+        data += vlq(0) + b"\xff\x03" + vlq(len(name)) + name
+    for _ in range(rng.randint(0, 100)):
+        data += vlq(rng.randint(0, 20000))
+        r = rng.random()
+        if r < 0.01:
+            data += b"\xff\x2f\x00"
+        elif r < 0.05:
+            meta_type, payload = rng.choice(META_PAYLOADS)
+            data += bytes([0xFF, meta_type]) + vlq(len(payload)) + payload
+        elif r < 0.08:
+            payload = bytes(rng.randint(0, 127) for _ in range(rng.randint(0, 10)))
+            payload += b"\xf7"
+            if last_status == 0xF0 and rng.random() < 0.3:
+                # Sysex under running status
+                data += b"\x05" + vlq(len(payload)) + payload
+            else:
+                data += b"\xf0" + vlq(len(payload)) + payload
+                last_status = 0xF0
+        elif r < 0.09:
+            status = rng.choice([0xF1, 0xF2, 0xF3, 0xF6, 0xF8, 0xFA, 0xFE])
+            n_data = {0xF1: 1, 0xF2: 2, 0xF3: 1}.get(status, 0)
+            data += bytes([status] + [rng.randint(0, 127) for _ in range(n_data)])
+            last_status = status
+        else:
+            status = rng.choice([0x80, 0x90, 0x90, 0x90, 0xA0, 0xB0, 0xC0, 0xD0, 0xE0])
+            status |= rng.randint(0, 15)
+            n_data = 1 if status & 0xF0 in (0xC0, 0xD0) else 2
+            payload = bytes(rng.randint(0, 127) for _ in range(n_data))
+            if status & 0xF0 == 0x90 and rng.random() < 0.3:
+                payload = payload[:1] + b"\x00"
+            if status == last_status and rng.random() < 0.7:
+                data += payload
+            else:
+                data += bytes([status]) + payload
+            last_status = status
+    data += END_OF_TRACK
+    if rng.random() < 0.05:
+        # Cut the track off somewhere, usually mid-event
+        del data[rng.randint(1, len(data)) :]
+    return bytes(data)
+
+
+def read_with_mido(path):
+    midi = mido.MidiFile(path, clip=True)
+    return [(track.name, plot.extract_note_counts(track)) for track in midi.tracks]
+
+
+@pytest.fixture(params=["default", "pure-python"])
+def scanner(request, monkeypatch):
+    """Run each test with the scanner as configured, and as plain Python."""
+    if request.param == "pure-python":
+        if plot.njit is None:
+            pytest.skip("numba is not installed, so the default is plain Python")
+        monkeypatch.setattr(plot, "njit", None)
+        monkeypatch.setattr(plot, "_meta_payload_ok", plot._meta_payload_ok.py_func)
+        monkeypatch.setattr(plot, "_scan_track_bytes", plot._scan_track_bytes.py_func)
+
+
+def assert_matches_mido(path):
+    try:
+        expected = read_with_mido(path)
+    except Exception:
+        with pytest.raises(ValueError):
+            plot._scan_midi_file(path)
+        return
+
+    scanned = plot._scan_midi_file(path)
+    assert [name for name, _ in scanned] == [name for name, _ in expected]
+    for (_, counts), (_, expected_counts) in zip(scanned, expected):
+        np.testing.assert_array_equal(counts, expected_counts)
+
+
+def test_random_files_match_mido(scanner, tmp_path):
+    rng = random.Random(1)
+    path = tmp_path / "random.mid"
+    for _ in range(300):
+        tracks = [random_track(rng) for _ in range(rng.randint(1, 4))]
+        path.write_bytes(smf(*tracks))
+        assert_matches_mido(path)
+
+
+@pytest.mark.parametrize(
+    "track",
+    [
+        # Running status
+        vlq(0) + b"\x90\x3c\x40" + vlq(10) + b"\x3e\x40" + vlq(10) + b"\x3c\x00",
+        # Notes after an early end_of_track are still read by mido
+        END_OF_TRACK + NOTE + END_OF_TRACK,
+        # Sysex under running status: mido drops the byte that was already read
+        vlq(0) + b"\xf0\x01\xf7" + vlq(0) + b"\x05\x02\x01\xf7" + NOTE,
+    ],
+)
+def test_valid_edge_cases_match_mido(scanner, tmp_path, track):
+    path = tmp_path / "edge.mid"
+    path.write_bytes(smf(track))
+    assert_matches_mido(path)
+
+
+@pytest.mark.parametrize(
+    "track",
+    [
+        # Final event truncated at the end of the chunk
+        NOTE + vlq(0) + b"\x90\x3c",
+        # Meta and sysex lengths that run past the end of the chunk
+        NOTE + vlq(0) + b"\xff\x01\x10abc",
+        NOTE + vlq(0) + b"\xf0\x10\x01\x02",
+        # Undefined status bytes
+        NOTE + vlq(0) + b"\xf4" + END_OF_TRACK,
+        NOTE + vlq(0) + b"\xf5" + END_OF_TRACK,
+        NOTE + vlq(0) + b"\xf9" + END_OF_TRACK,
+        NOTE + vlq(0) + b"\xfd" + END_OF_TRACK,
+        # Running status without a previous status byte
+        vlq(0) + b"\x3c\x40" + END_OF_TRACK,
+    ],
+)
+def test_malformed_files_fall_back_to_mido(scanner, tmp_path, track):
+    path = tmp_path / "bad.mid"
+    path.write_bytes(smf(track))
+    with pytest.raises(ValueError):
+        plot._scan_midi_file(path)
+    with pytest.raises(Exception) as mido_error:
+        read_with_mido(path)
+    # The public reader reports mido's error rather than the scanner's
+    with pytest.raises(type(mido_error.value)) as reader_error:
+        plot.read_track_note_counts(path)
+    assert str(reader_error.value) == str(mido_error.value)